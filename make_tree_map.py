@@ -2,17 +2,680 @@
 import pandas as pd
 import geopandas as gpd
 import folium
+from folium.elements import JSCSSMixin
+from folium.plugins import FastMarkerCluster
+from jinja2 import Template
 import numpy as np
-from itertools import cycle
+import shapely
+from pyproj import Transformer
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle, repeat
 from pathlib import Path
-import base64
+from PIL import Image, ImageOps
+from urllib.parse import quote
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+
+
+# =====================================================
+# INVENTORY COLUMNS
+# =====================================================
+
+TREE_COLUMNS = [
+    "lat", "lon", "Genus", "Species", "TreeCode",
+    "CrownNSm", "CrownEWm", "DBH1cm", "Heightm",
+]
+
+
+def read_inventory(excel_path):
+    """
+    Read the Trees sheet, preferring the Rust-backed calamine engine and
+    falling back to openpyxl in read-only mode when it is not installed
+    or pandas is too old to offer it (calamine needs pandas >= 2.2).
+
+    Only the columns in TREE_COLUMNS are kept; missing optional ones are
+    tolerated.
+    """
+    pandas_version = tuple(
+        int(part) for part in pd.__version__.split(".")[:2]
+    )
+
+    if (
+        pandas_version >= (2, 2)
+        and importlib.util.find_spec("python_calamine") is not None
+    ):
+        engine_opts = {"engine": "calamine"}
+    else:
+        engine_opts = {
+            "engine": "openpyxl",
+            "engine_kwargs": {"read_only": True, "data_only": True},
+        }
+
+    return pd.read_excel(
+        excel_path,
+        sheet_name="Trees",
+        usecols=lambda c: c in TREE_COLUMNS,
+        **engine_opts,
+    )
+
+
+def find_inputs(base_dir):
+    """
+    Locate the inventory workbook and boundary shapefile in a school folder.
+
+    Returns
+    -------
+    (excel_path, school_name, boundary_path)
+    """
+    excel_files = list(base_dir.glob("*.xlsx"))
+    if not excel_files:
+        raise FileNotFoundError("❌ No Excel file found in folder.")
+
+    excel_path = excel_files[0]
+
+    school_name = (
+        excel_path.stem
+        .replace("Tree Data", "")
+        .replace("tree data", "")
+        .strip()
+    )
+
+    boundary_path = base_dir / "Boundaries" / "Boundaries.shp"
+    if not boundary_path.exists():
+        raise FileNotFoundError("❌ Missing Boundaries/Boundaries.shp")
+
+    return excel_path, school_name, boundary_path
+
+
+def load_trees(excel_path):
+    """
+    Read the inventory and return its columns as NumPy arrays, keyed
+    ``lat``, ``lon``, ``genus``, ``species``, ``tree_code``, ``dbh``,
+    ``height`` and ``crown_radius`` (metres, NaN when unknown).
+
+    Rows without coordinates are dropped; the DataFrame is not kept.
+    """
+    df_map = read_inventory(excel_path)
+    df_map = df_map.dropna(subset=["lat", "lon"])
+
+    n_trees = len(df_map)
+
+    def text_column(name):
+        if name not in df_map:
+            return np.full(n_trees, "", dtype=object)
+        return df_map[name].to_numpy(dtype=object)
+
+    def number_column(name):
+        if name not in df_map:
+            return np.full(n_trees, np.nan)
+        return pd.to_numeric(df_map[name], errors="coerce").to_numpy(dtype=float)
+
+    ns = number_column("CrownNSm")
+    ew = number_column("CrownEWm")
+
+    # -------- CANOPY SIZE --------
+    has_ns = ~np.isnan(ns)
+    has_ew = ~np.isnan(ew)
+
+    crown_radius = np.where(
+        has_ns & has_ew, (ns + ew) / 4,
+        np.where(has_ns, ns / 2, np.where(has_ew, ew / 2, np.nan))
+    )
+
+    return {
+        "lat": number_column("lat"),
+        "lon": number_column("lon"),
+        "genus": text_column("Genus"),
+        "species": text_column("Species"),
+        "tree_code": np.array(
+            ["" if pd.isna(c) else str(c).strip()
+             for c in text_column("TreeCode")],
+            dtype=object,
+        ),
+        "dbh": text_column("DBH1cm"),
+        "height": text_column("Heightm"),
+        "crown_radius": crown_radius,
+    }
+
+
+# Photos are thumbnailed, one thread-pool batch at a time, for blocks
+# of this many rows while the tree features are built
+FEATURE_CHUNK = 1000
+
+
+def row_chunks(n_rows, chunk_size=FEATURE_CHUNK):
+    """
+    Yield consecutive row slices of at most ``chunk_size`` rows.
+    """
+    for start in range(0, n_rows, chunk_size):
+        yield slice(start, min(start + chunk_size, n_rows))
+
+
+# Feature property -> popup label, in display order
+POPUP_FIELDS = {
+    "tree_code": "Tree code:",
+    "genus": "Genus:",
+    "species": "Species:",
+    "dbh": "DBH (cm):",
+    "height": "Height (m):",
+    "photo": "",
+}
+
+
+def cell_value(value):
+    """
+    JSON-friendly popup value: blank for missing cells, and text for
+    anything JSON cannot hold (e.g. a DBH cell Excel turned into a date).
+    """
+    if pd.isna(value):
+        return ""
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+# =====================================================
+# GEOMETRY HELPERS
+# =====================================================
+
+# Degrees; 1e-5 is about 1.1 m at the equator
+BOUNDARY_TOLERANCE = 1e-5
+
+
+def reproject(gdf, crs="EPSG:4326"):
+    """
+    Reproject all geometries with one Transformer call over the flat
+    coordinate arrays.
+    """
+    transformer = Transformer.from_crs(gdf.crs, crs, always_xy=True)
+
+    geoms = shapely.force_2d(gdf.geometry.to_numpy())
+    coords = shapely.get_coordinates(geoms)
+
+    x, y = transformer.transform(coords[:, 0], coords[:, 1])
+    geoms = shapely.set_coordinates(geoms, np.column_stack([x, y]))
+
+    return gdf.set_geometry(
+        gpd.GeoSeries(geoms, index=gdf.index, crs=crs)
+    )
+
+
+def load_boundary(boundary_path):
+    """
+    Read the school boundary as simplified EPSG:4326 geometries.
+    Shapefiles without a .prj are assumed to be California Albers.
+    """
+    gdf = gpd.read_file(boundary_path)
+
+    if gdf.crs is None:
+        gdf = gdf.set_crs(epsg=3310)
+
+    gdf = reproject(gdf)
+
+    # Drop near-collinear cadastral vertices; invisible at campus zoom
+    geoms = shapely.simplify(
+        gdf.geometry.to_numpy(), BOUNDARY_TOLERANCE, preserve_topology=True
+    )
+
+    return gdf.set_geometry(
+        gpd.GeoSeries(geoms, index=gdf.index, crs=gdf.crs)
+    )
+
+
+def to_feature_collection(geoms):
+    """
+    Serialize geometries to a GeoJSON FeatureCollection string with one
+    vectorized shapely.to_geojson call (no per-feature __geo_interface__).
+    Attributes are not carried over.
+    """
+    geoms = np.asarray(geoms)
+    geoms = geoms[~shapely.is_missing(geoms)]
+
+    features = ",".join(
+        f'{{"type":"Feature","properties":{{}},"geometry":{g}}}'
+        for g in shapely.to_geojson(geoms)
+    )
+
+    return f'{{"type":"FeatureCollection","features":[{features}]}}'
+
+
+# =====================================================
+# GENUS STYLES
+# =====================================================
+
+GENUS_SHAPES = [
+    {"sides": 3, "rotation": 0},
+    {"sides": 4, "rotation": 45},
+    {"sides": 5, "rotation": 0},
+    {"sides": 6, "rotation": 0},
+    {"sides": 8, "rotation": 0},
+    {"sides": 3, "rotation": 180},
+    {"sides": 4, "rotation": 0},
+]
+
+GENUS_COLORS = [
+    "red", "blue", "green", "purple", "orange",
+    "darkred", "darkblue", "darkgreen",
+    "cadetblue", "pink", "black", "gray",
+]
+
+# Style for trees without a genus
+DEFAULT_SHAPE = {"sides": 4, "rotation": 0}
+DEFAULT_COLOR = "gray"
+
+# CSS colour names above as RGB, for renderers that need numbers
+COLOR_RGB = {
+    "red": (255, 0, 0),
+    "blue": (0, 0, 255),
+    "green": (0, 128, 0),
+    "purple": (128, 0, 128),
+    "orange": (255, 165, 0),
+    "darkred": (139, 0, 0),
+    "darkblue": (0, 0, 139),
+    "darkgreen": (0, 100, 0),
+    "cadetblue": (95, 158, 160),
+    "pink": (255, 192, 203),
+    "black": (0, 0, 0),
+    "gray": (128, 128, 128),
+}
+
+
+def genus_style_table(genus_col):
+    """
+    Per-tree marker styles from the genus column.
+
+    Genera get shapes and colours in sorted order, cycling through
+    GENUS_SHAPES and GENUS_COLORS.
+
+    Returns
+    -------
+    (sides, rotations, colors) lists, one entry per tree
+    """
+    # Integer genus codes (sorted categories, -1 for missing genus)
+    genus_cat = pd.Categorical(genus_col)
+
+    shapes = cycle(GENUS_SHAPES)
+    cols = cycle(GENUS_COLORS)
+
+    genus_styles = [
+        (next(shapes), next(cols))
+        for _ in genus_cat.categories
+    ]
+
+    # Lookup tables indexed by genus code; the extra last row is the
+    # default style, which code -1 (missing genus) lands on
+    sides_lut = np.array(
+        [shape["sides"] for shape, _ in genus_styles]
+        + [DEFAULT_SHAPE["sides"]]
+    )
+    rotation_lut = np.array(
+        [shape["rotation"] for shape, _ in genus_styles]
+        + [DEFAULT_SHAPE["rotation"]]
+    )
+    color_lut = np.array(
+        [color for _, color in genus_styles] + [DEFAULT_COLOR], dtype=object
+    )
+
+    genus_codes = genus_cat.codes
+
+    return (
+        sides_lut[genus_codes].tolist(),
+        rotation_lut[genus_codes].tolist(),
+        color_lut[genus_codes].tolist(),
+    )
+
+
+# =====================================================
+# PHOTO HELPERS
+# =====================================================
+
+PHOTO_SUFFIXES = {".jpg", ".jpeg", ".png"}
+
+# Popup thumbnails are written here, next to the output HTML, and
+# referenced by relative URL instead of being embedded
+THUMBS_DIR_NAME = "Photos_web"
+
+# Popup photo cell, formatted once per photo rather than per tree
+PHOTO_TEMPLATE = (
+    '<img src="{src}" loading="lazy" width="200" '
+    'style="border-radius:8px;margin-top:6px;">'
+)
+NO_PHOTO_HTML = "<i>No photo available</i>"
+
+# Popups show photos at 200 px wide; 400 px keeps them sharp on HiDPI
+THUMB_SIZE = (400, 400)
+THUMB_QUALITY = 75
+
+# Thumbnailing is mostly file I/O and Pillow work, both release the GIL
+PHOTO_WORKERS = 8
+
+
+def index_photos(photos_dir):
+    """
+    Scan the photos folder once and map lower-cased file stems to paths.
+    """
+    index = {}
+
+    with os.scandir(photos_dir) as entries:
+        for entry in entries:
+            path = Path(entry.path)
+            if entry.is_file() and path.suffix.lower() in PHOTO_SUFFIXES:
+                index.setdefault(path.stem.lower(), path)
+
+    return index
+
+
+def find_photo(photo_index, code):
+    """
+    Exact stem match first, otherwise the first stem containing the code.
+    """
+    match = photo_index.get(code)
+    if match is None:
+        match = next(
+            (p for stem, p in photo_index.items() if code in stem),
+            None,
+        )
+    return match
+
+
+def write_thumbnail(img_path, thumbs_dir):
+    """
+    Save a downscaled JPEG copy of a photo into ``thumbs_dir`` and return
+    its file name. Each thumbnail is stamped with its source's mtime and
+    reused only while the two still match exactly; an older photo
+    restored over a newer one (e.g. by unzipping) is re-thumbnailed.
+
+    Returns None when the photo cannot be read as an image, so one bad
+    file does not stop the whole map.
+    """
+    thumb_path = thumbs_dir / f"{img_path.stem}.jpg"
+    src = img_path.stat()
+
+    if thumb_path.exists() and thumb_path.stat().st_mtime_ns == src.st_mtime_ns:
+        return thumb_path.name
+
+    try:
+        with Image.open(img_path) as img:
+            # Re-encoding drops EXIF, so bake the camera orientation in first
+            thumb = ImageOps.exif_transpose(img)
+            thumb.thumbnail(THUMB_SIZE)
+            thumb.convert("RGB").save(
+                thumb_path, "JPEG", quality=THUMB_QUALITY, optimize=True
+            )
+        os.utime(thumb_path, ns=(src.st_atime_ns, src.st_mtime_ns))
+    except (OSError, Image.DecompressionBombError) as err:
+        thumb_path.unlink(missing_ok=True)
+        print(f"⚠️ Skipping unreadable photo {img_path.name}: {err}")
+        return None
+
+    return thumb_path.name
+
+
+# =====================================================
+# TREE MARKERS
+# =====================================================
+
+# Builds one genus-styled marker per data row, with its own popup:
+# row = [lat, lon, sides, rotation, color, *values in POPUP_FIELDS order].
+# The popup is bound on each marker, so it works inside the cluster group.
+TREE_MARKER_CALLBACK = """
+function (row) {
+    var labels = """ + json.dumps(list(POPUP_FIELDS.values())) + """;
+
+    var marker = new L.RegularPolygonMarker(new L.LatLng(row[0], row[1]), {
+        numberOfSides: row[2],
+        rotation: row[3],
+        radius: 7,
+        color: row[4],
+        fillColor: row[4],
+        fill: true,
+        fillOpacity: 0.9,
+    });
+
+    var cells = "";
+    for (var i = 0; i < labels.length; i++) {
+        cells += "<tr><th>" + labels[i] + "</th><td>" + row[5 + i] + "</td></tr>";
+    }
+    marker.bindPopup(
+        '<table style="font-size:13px;">' + cells + "</table>",
+        {maxWidth: 300}
+    );
+
+    return marker;
+}
+"""
+
+
+# =====================================================
+# VECTOR TILES (VERY LARGE INVENTORIES)
+# =====================================================
+
+def point_features(lon, lat, **properties):
+    """
+    GeoJSON FeatureCollection of points, one per lon/lat pair, with each
+    keyword argument giving a per-point property column.
+    """
+    names = list(properties)
+
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [x, y]},
+                "properties": dict(zip(names, values)),
+            }
+            for x, y, *values in zip(
+                lon.tolist(), lat.tolist(), *properties.values()
+            )
+        ],
+    }
+
+
+def export_tree_tiles(lon, lat, colors, crown_radius, out_dir, stem):
+    """
+    Write the trees to ``<stem>.pmtiles`` with tippecanoe: a ``trees``
+    layer carrying the genus colour and a ``crowns`` layer carrying the
+    crown radius in metres (trees without a crown are left out).
+
+    Raises FileNotFoundError when tippecanoe is not on PATH.
+    """
+    tippecanoe = shutil.which("tippecanoe")
+    if tippecanoe is None:
+        raise FileNotFoundError(
+            "❌ tippecanoe not found on PATH (needed for tiles=True)"
+        )
+
+    tiles_path = out_dir / f"{stem}.pmtiles"
+
+    # NaN compares False, so missing and zero-sized crowns are skipped
+    has_crown = crown_radius > 0
+
+    layers = {
+        "trees": point_features(lon, lat, color=colors),
+        "crowns": point_features(
+            lon[has_crown],
+            lat[has_crown],
+            radius=[round(r, 2) for r in crown_radius[has_crown].tolist()],
+        ),
+    }
+
+    geojson_paths = []
+    command = [
+        tippecanoe, "-o", str(tiles_path), "--force",
+        "-zg", "--drop-densest-as-needed",
+    ]
+
+    try:
+        for layer, features in layers.items():
+            if not features["features"]:
+                continue
+
+            geojson_path = out_dir / f"{stem}_{layer}.geojson"
+            geojson_path.write_text(json.dumps(features))
+            geojson_paths.append(geojson_path)
+
+            command += ["-L", f"{layer}:{geojson_path}"]
+
+        subprocess.run(command, check=True)
+    finally:
+        for geojson_path in geojson_paths:
+            geojson_path.unlink(missing_ok=True)
+
+    return tiles_path
+
+
+class TreeTileLayer(JSCSSMixin, folium.MacroElement):
+    """
+    protomaps-leaflet layer drawing the ``crowns`` PMTiles layer as
+    canopy circles and the ``trees`` layer as circles coloured by genus.
+
+    Crown radii are stored in metres; they are scaled to pixels at each
+    zoom using the map's centre latitude (fine at campus scale).
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = protomapsL.leafletLayer({
+                url: {{ this.url|tojson }},
+                paintRules: [{
+                    dataLayer: "crowns",
+                    symbolizer: new protomapsL.CircleSymbolizer({
+                        radius: (z, f) => f.props.radius * 256 * 2 ** z
+                            / (40075016.686 * Math.cos({{ this.lat }} * Math.PI / 180)),
+                        fill: "#3388ff",
+                        opacity: 0.3,
+                        width: 0,
+                    }),
+                }, {
+                    dataLayer: "trees",
+                    symbolizer: new protomapsL.CircleSymbolizer({
+                        radius: 4,
+                        fill: (z, f) => f.props.color,
+                        stroke: "white",
+                        width: 0.5,
+                    }),
+                }],
+            }).addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+    """)
+
+    default_js = [
+        (
+            "protomaps_leaflet",
+            "https://unpkg.com/protomaps-leaflet@4/dist/protomaps-leaflet.js",
+        ),
+    ]
+
+    def __init__(self, url, lat):
+        super().__init__()
+        self._name = "TreeTileLayer"
+        self.url = url
+        self.lat = lat
+
+
+# =====================================================
+# RENDER CACHE
+# =====================================================
+
+CACHE_DIR_NAME = ".cache"
+
+
+def map_cache_key(excel_path, boundary_path, photos_dir, tiles=False):
+    """
+    Hash the input paths and modification times (plus this script's, so
+    code changes invalidate old maps) and the tiling mode into a short
+    cache key.
+
+    Every photo is stamped individually: editing a file in place does
+    not touch the folder's own mtime.
+    """
+    inputs = [Path(__file__), excel_path, *boundary_path.parent.iterdir()]
+    if photos_dir.exists():
+        inputs.extend(p for p in photos_dir.iterdir() if p.is_file())
+
+    stamp = repr((
+        sorted((str(p), p.stat().st_mtime_ns) for p in inputs),
+        tiles,
+    ))
+
+    return hashlib.sha256(stamp.encode("utf-8")).hexdigest()[:16]
+
+
+def cached_map_is_valid(cache_html, base_dir):
+    """
+    True when the cached HTML exists and so does every file it links to
+    (thumbnails, tiles), as listed in its manifest.
+    """
+    manifest = cache_html.with_suffix(".json")
+    if not (cache_html.exists() and manifest.exists()):
+        return False
+
+    outputs = json.loads(manifest.read_text())
+
+    return all((base_dir / rel).exists() for rel in outputs)
+
+
+def store_cached_map(html_path, cache_html, outputs):
+    """
+    Copy a freshly built map into the cache, with a manifest of the
+    output files (relative to the school folder) it depends on. Older
+    entries for the same map are removed.
+    """
+    cache_dir = cache_html.parent
+    cache_dir.mkdir(exist_ok=True)
+
+    map_stem = cache_html.stem.rsplit("_", 1)[0]
+    for stale in cache_dir.glob(f"{map_stem}_*"):
+        stale.unlink()
+
+    shutil.copy(html_path, cache_html)
+    cache_html.with_suffix(".json").write_text(json.dumps(sorted(outputs)))
+
+
+# =====================================================
+# BASE MAP
+# =====================================================
+
+# Extra basemaps offered in the layer control, on top of OpenStreetMap
+BASE_TILE_LAYERS = [
+    {"tiles": "CartoDB positron"},
+    {
+        "tiles": "https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{x}/{y}",
+        "attr": "ESRI World Imagery",
+        "name": "Satellite",
+        "overlay": False,
+        "control": True,
+    },
+]
+
+
+def base_map(center):
+    """
+    Folium map centred on a campus with the shared basemap layers.
+    """
+    m = folium.Map(
+        location=center,
+        zoom_start=18,
+        tiles="OpenStreetMap",
+        name="OSM"
+    )
+
+    for layer in BASE_TILE_LAYERS:
+        folium.TileLayer(**layer).add_to(m)
+
+    return m
 
 
 # =====================================================
 # MAIN FUNCTION
 # =====================================================
 
-def build_tree_map():
+def build_tree_map(base_dir=None, use_cache=False, tiles=False):
 
     """
     Build an interactive tree inventory map for ANY school dataset.
@@ -25,86 +688,99 @@ def build_tree_map():
     └── Photos/   (optional)
           └── TreeCode.jpg / png ...
 
+    Popup thumbnails are written to Photos_web/ next to the output HTML;
+    keep the two together when sharing the map.
+
+    Parameters
+    ----------
+    base_dir : str or Path, optional
+        School folder to build from. Defaults to the folder holding this
+        script.
+    use_cache : bool
+        Reuse the HTML from a previous run when none of the inputs have
+        changed since (see ``map_cache_key``). Off by default so the
+        returned map can always be displayed, e.g. in Colab.
+    tiles : bool
+        Draw trees and crowns from a ``<School>_trees.pmtiles`` file built
+        with tippecanoe (which must be on PATH) instead of inline
+        markers. Meant for inventories too large for Leaflet markers;
+        tiled trees have no popups, and the map must be served over HTTP.
+
     Returns
     -------
-    folium.Map
+    folium.Map, or None when a cached map was reused
     """
 
     # -------------------------------------------------
     # BASE DIR
     # -------------------------------------------------
-    base_dir = Path(__file__).parent.resolve()
+    if base_dir is None:
+        base_dir = Path(__file__).parent
+    base_dir = Path(base_dir).resolve()
 
     # -------------------------------------------------
-    # FIND EXCEL
+    # FIND INPUTS
     # -------------------------------------------------
-    excel_files = list(base_dir.glob("*.xlsx"))
-    if not excel_files:
-        raise FileNotFoundError("❌ No Excel file found in folder.")
-
-    excel_path = excel_files[0]
-
-    school_name = (
-        excel_path.stem
-        .replace("Tree Data", "")
-        .replace("tree data", "")
-        .strip()
-    )
+    excel_path, school_name, boundary_path = find_inputs(base_dir)
 
     OUTPUT_HTML = f"{school_name.replace(' ','_')}_tree_map.html"
 
     # -------------------------------------------------
-    # BOUNDARY
+    # PHOTOS
     # -------------------------------------------------
-    boundary_path = base_dir / "Boundaries" / "Boundaries.shp"
-    if not boundary_path.exists():
-        raise FileNotFoundError("❌ Missing Boundaries/Boundaries.shp")
+    photos_dir = base_dir / "Photos"
+    thumbs_dir = base_dir / THUMBS_DIR_NAME
 
     # -------------------------------------------------
-    # PHOTOS
+    # RENDER CACHE
     # -------------------------------------------------
-    photos_dir = base_dir / "Photos"
+    # Only hashed on request: stamping every photo is not free
+    if use_cache:
+        cache_dir = base_dir / CACHE_DIR_NAME
+        cache_key = map_cache_key(
+            excel_path, boundary_path, photos_dir, tiles
+        )
+        cache_html = cache_dir / f"{Path(OUTPUT_HTML).stem}_{cache_key}.html"
+
+        if cached_map_is_valid(cache_html, base_dir):
+            shutil.copy(cache_html, base_dir / OUTPUT_HTML)
+
+            print(f"♻️ Inputs unchanged, reused cached map for: {school_name}")
+            print(f"📄 Output: {OUTPUT_HTML}")
+
+            return None
+
+    photo_index = index_photos(photos_dir) if photos_dir.exists() else None
 
     # -------------------------------------------------
     # LOAD INVENTORY
     # -------------------------------------------------
-    df_map = pd.read_excel(excel_path, sheet_name="Trees")
-    df_map = df_map.dropna(subset=["lat", "lon"])
+    trees = load_trees(excel_path)
+
+    n_trees = len(trees["lat"])
 
-    center = [df_map["lat"].mean(), df_map["lon"].mean()]
+    lat, lon = trees["lat"], trees["lon"]
+    genus_col = trees["genus"]
+    species_col = trees["species"]
+    tree_codes = trees["tree_code"]
+    dbh_col = trees["dbh"]
+    height_col = trees["height"]
+    crown_radius = trees["crown_radius"]
+
+    center = [lat.mean(), lon.mean()]
 
     # -------------------------------------------------
     # BASE MAP
     # -------------------------------------------------
-    m = folium.Map(
-        location=center,
-        zoom_start=18,
-        tiles="OpenStreetMap",
-        name="OSM"
-    )
-
-    folium.TileLayer("CartoDB positron").add_to(m)
-
-    folium.TileLayer(
-        "https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{x}/{y}",
-        attr="ESRI World Imagery",
-        name="Satellite",
-        overlay=False,
-        control=True,
-    ).add_to(m)
+    m = base_map(center)
 
     # -------------------------------------------------
     # SCHOOL BOUNDARY
     # -------------------------------------------------
-    gdf = gpd.read_file(boundary_path)
-
-    if gdf.crs is None:
-        gdf = gdf.set_crs(epsg=3310)
-
-    gdf = gdf.to_crs(epsg=4326)
+    gdf = load_boundary(boundary_path)
 
     folium.GeoJson(
-        gdf,
+        to_feature_collection(gdf.geometry.to_numpy()),
         name="School boundary",
         style_function=lambda x: {
             "color": "black",
@@ -117,129 +793,149 @@ def build_tree_map():
     # -------------------------------------------------
     # GENUS STYLES
     # -------------------------------------------------
-    genera = sorted(df_map["Genus"].dropna().unique())
+    tree_sides, tree_rotations, tree_colors = genus_style_table(genus_col)
 
-    shape_specs = [
-        {"sides": 3, "rotation": 0},
-        {"sides": 4, "rotation": 45},
-        {"sides": 5, "rotation": 0},
-        {"sides": 6, "rotation": 0},
-        {"sides": 8, "rotation": 0},
-        {"sides": 3, "rotation": 180},
-        {"sides": 4, "rotation": 0},
-    ]
+    # -------------------------------------------------
+    # CANOPY — ONE GEOJSON CIRCLE LAYER
+    # -------------------------------------------------
+    # NaN compares False, so missing and zero-sized crowns are skipped.
+    # Tiled maps carry the canopy in the tiles instead.
+    has_crown = crown_radius > 0
 
-    colors = [
-        "red", "blue", "green", "purple", "orange",
-        "darkred", "darkblue", "darkgreen",
-        "cadetblue", "pink", "black", "gray",
-    ]
+    if has_crown.any() and not tiles:
 
-    shapes = cycle(shape_specs)
-    cols = cycle(colors)
+        # One point per crown, drawn as an L.Circle with a radius in metres;
+        # far smaller than shipping a buffered polygon for every tree
+        crowns = {
+            "type": "FeatureCollection",
+            "features": [
+                {
+                    "type": "Feature",
+                    "geometry": {
+                        "type": "Point",
+                        "coordinates": [round(x, 7), round(y, 7)],
+                    },
+                    "properties": {"radius": round(r, 2)},
+                }
+                for x, y, r in zip(
+                    lon[has_crown].tolist(),
+                    lat[has_crown].tolist(),
+                    crown_radius[has_crown].tolist(),
+                )
+            ],
+        }
 
-    genus_styles = {
-        g: {"shape": next(shapes), "color": next(cols)}
-        for g in genera
-    }
+        folium.GeoJson(
+            crowns,
+            name="Canopy",
+            marker=folium.Circle(
+                location=None,
+                fill=True,
+                fill_opacity=0.3,
+                stroke=False,
+            ),
+            style_function=lambda f: {
+                "radius": f["properties"]["radius"],
+                "stroke": False,
+                "fillColor": "#3388ff",
+                "fillOpacity": 0.3,
+            },
+        ).add_to(m)
 
-    # =================================================
-    # ADD TREES — ORIGINAL BLOCK RESTORED ✅
-    # =================================================
+    # -------------------------------------------------
+    # PHOTOS — THUMBNAILED IN PARALLEL
+    # -------------------------------------------------
+    photo_htmls = {}
+    thumb_files = set()
 
-    for _, r in df_map.iterrows():
+    def make_thumbnails(codes):
+        """
+        Fill photo_htmls for tree codes not seen in an earlier chunk.
+        """
+        needed_codes = {c.lower() for c in codes if c} - photo_htmls.keys()
+        photo_paths = {c: find_photo(photo_index, c) for c in needed_codes}
 
-        lat, lon = float(r["lat"]), float(r["lon"])
-        genus = r.get("Genus", "NA")
-        tree_code = str(r.get("TreeCode", "")).strip()
+        unique_paths = list({p for p in photo_paths.values() if p is not None})
+        thumbs_dir.mkdir(exist_ok=True)
 
-        style = genus_styles.get(genus)
+        with ThreadPoolExecutor(max_workers=PHOTO_WORKERS) as ex:
+            thumbs = dict(zip(
+                unique_paths,
+                ex.map(write_thumbnail, unique_paths, repeat(thumbs_dir)),
+            ))
 
-        # -------- CANOPY SIZE --------
-        ns = r.get("CrownNSm", np.nan)
-        ew = r.get("CrownEWm", np.nan)
+        for code, img_path in photo_paths.items():
+            thumb_name = thumbs.get(img_path)
+            if thumb_name is not None:
+                thumb_files.add(f"{THUMBS_DIR_NAME}/{thumb_name}")
+                photo_htmls[code] = PHOTO_TEMPLATE.format_map({
+                    "src": f"{THUMBS_DIR_NAME}/{quote(thumb_name)}",
+                })
+            else:
+                photo_htmls[code] = NO_PHOTO_HTML
+
+    # =================================================
+    # ADD TREES — IN ROW CHUNKS
+    # =================================================
+    # Tiled trees carry no popups, so their photos are never thumbnailed
+    tree_rows = []
 
-        crown_radius = None
-        if pd.notna(ns) and pd.notna(ew):
-            crown_radius = (ns + ew) / 4
-        elif pd.notna(ns):
-            crown_radius = ns / 2
-        elif pd.notna(ew):
-            crown_radius = ew / 2
+    for rows in row_chunks(0 if tiles else n_trees):
 
-        if crown_radius:
-            folium.Circle(
-                location=[lat, lon],
-                radius=crown_radius,
-                fill=True,
-                fill_opacity=0.3,
-                color=None,
-                stroke=False,
-            ).add_to(m)
+        if photo_index is not None:
+            make_thumbnails(tree_codes[rows])
 
-        # -------- PHOTO LOOKUP --------
-        photo_html = ""
+        for i in range(rows.start, rows.stop):
 
-        if tree_code and photos_dir.exists():
+            tree_code = tree_codes[i]
 
-            code = tree_code.lower()
+            tree_rows.append([
+                float(lat[i]),
+                float(lon[i]),
+                tree_sides[i],
+                tree_rotations[i],
+                tree_colors[i],
+                # popup values, in POPUP_FIELDS order
+                tree_code,
+                cell_value(genus_col[i]),
+                cell_value(species_col[i]),
+                cell_value(dbh_col[i]),
+                cell_value(height_col[i]),
+                photo_htmls.get(tree_code.lower(), ""),
+            ])
 
-            matches = [
-                p for p in photos_dir.iterdir()
-                if code in p.stem.lower()
-                and p.suffix.lower() in [".jpg", ".jpeg", ".png"]
-            ]
+    # -------------------------------------------------
+    # TREE MARKERS — VECTOR TILES FOR HUGE INVENTORIES
+    # -------------------------------------------------
+    tiles_path = None
+    if tiles:
+        tiles_path = export_tree_tiles(
+            lon, lat, tree_colors, crown_radius,
+            base_dir, f"{school_name.replace(' ','_')}_trees",
+        )
 
-            if matches:
-                img_path = matches[0]
+        TreeTileLayer(tiles_path.name, float(center[0])).add_to(m)
 
-                with open(img_path, "rb") as f:
-                    encoded = base64.b64encode(f.read()).decode("utf-8")
+        print(f"🧱 Trees tiled into: {tiles_path.name}")
+        print("   Serve the folder over HTTP to view the tiled layer.")
 
-                ext = img_path.suffix.lower().replace(".", "")
-                if ext == "jpg":
-                    ext = "jpeg"
+    # -------------------------------------------------
+    # TREE MARKERS — ONE CLUSTERED DATA ARRAY
+    # -------------------------------------------------
+    elif tree_rows:
 
-                photo_html = f"""
-                <br>
-                <img src="data:image/{ext};base64,{encoded}"
-                     width="200"
-                     style="border-radius:8px;margin-top:6px;">
-                """
-            else:
-                photo_html = "<br><i>No photo available</i>"
-
-        # -------- POPUP --------
-        popup_html = f"""
-        <div style="font-size:13px;">
-            <b>Tree code:</b> {tree_code}<br>
-            <b>Genus:</b> {r.get('Genus','')}<br>
-            <b>Species:</b> {r.get('Species','')}<br>
-            <b>DBH (cm):</b> {r.get('DBH1cm','')}<br>
-            <b>Height (m):</b> {r.get('Heightm','')}
-            {photo_html}
-        </div>
-        """
+        # The callback builds L.RegularPolygonMarker directly, so load the
+        # leaflet-dvf script the marker class normally brings along
+        for name, url in folium.RegularPolygonMarker.default_js:
+            m.get_root().header.add_child(folium.JavascriptLink(url), name=name)
 
-        popup = folium.Popup(popup_html, max_width=300)
-
-        # -------- MARKERS --------
-        if style:
-            shape = style["shape"]
-            color = style["color"]
-        else:
-            shape = {"sides": 4, "rotation": 0}
-            color = "gray"
-
-        folium.RegularPolygonMarker(
-            location=[lat, lon],
-            number_of_sides=shape["sides"],
-            rotation=shape["rotation"],
-            radius=7,
-            color=color,
-            fill=True,
-            fill_opacity=0.9,
-            popup=popup,
+        # Markers cluster when zoomed out and separate again at the
+        # campus zoom level the map opens on
+        FastMarkerCluster(
+            tree_rows,
+            callback=TREE_MARKER_CALLBACK,
+            name="Trees",
+            disable_clustering_at_zoom=18,
         ).add_to(m)
 
     # =================================================
@@ -249,7 +945,138 @@ def build_tree_map():
 
     m.save(base_dir / OUTPUT_HTML)
 
+    if use_cache:
+        outputs = set(thumb_files)
+        if tiles_path is not None:
+            outputs.add(tiles_path.name)
+
+        store_cached_map(base_dir / OUTPUT_HTML, cache_html, outputs)
+
     print(f"✅ Map created for: {school_name}")
     print(f"📄 Output: {OUTPUT_HTML}")
 
     return m
+
+
+# =====================================================
+# BATCH
+# =====================================================
+
+def build_tree_maps(root_dir, use_cache=True, tiles=False):
+
+    """
+    Build a tree map for every school folder directly inside ``root_dir``
+    (any subfolder holding an .xlsx inventory).
+
+    Unlike ``build_tree_map``, the render cache is on by default here:
+    unchanged schools are copied from the cache and map to None.
+
+    Returns
+    -------
+    dict
+        Folder name -> result of ``build_tree_map`` for that school.
+    """
+
+    maps = {}
+
+    for school_dir in sorted(Path(root_dir).iterdir()):
+        if school_dir.is_dir() and any(school_dir.glob("*.xlsx")):
+            maps[school_dir.name] = build_tree_map(
+                school_dir, use_cache=use_cache, tiles=tiles
+            )
+
+    return maps
+
+
+# =====================================================
+# GPU MAP (LONBOARD / DECK.GL)
+# =====================================================
+
+def build_tree_gpu_map(base_dir=None):
+
+    """
+    Build a WebGL tree map with lonboard for inventories too large for
+    Leaflet markers.
+
+    Uses the same folder structure and ``base_dir`` default as
+    ``build_tree_map``. Trees are drawn as one deck.gl ScatterplotLayer,
+    sized by crown radius and coloured by genus, over the school
+    boundary. Clicking a tree shows its attributes; photos are not shown.
+
+    Returns
+    -------
+    lonboard.Map
+    """
+
+    try:
+        from lonboard import Map, PolygonLayer, ScatterplotLayer
+    except ImportError as err:
+        raise ImportError(
+            "❌ build_tree_gpu_map needs lonboard: pip install lonboard"
+        ) from err
+
+    # -------------------------------------------------
+    # INPUTS
+    # -------------------------------------------------
+    if base_dir is None:
+        base_dir = Path(__file__).parent
+    base_dir = Path(base_dir).resolve()
+
+    excel_path, school_name, boundary_path = find_inputs(base_dir)
+
+    OUTPUT_HTML = f"{school_name.replace(' ','_')}_tree_map_gpu.html"
+
+    trees = load_trees(excel_path)
+
+    # -------------------------------------------------
+    # TREE POINTS
+    # -------------------------------------------------
+    _, _, tree_colors = genus_style_table(trees["genus"])
+
+    points = gpd.GeoDataFrame(
+        {
+            "tree_code": trees["tree_code"],
+            "genus": [str(cell_value(v)) for v in trees["genus"]],
+            "species": [str(cell_value(v)) for v in trees["species"]],
+            "dbh": [str(cell_value(v)) for v in trees["dbh"]],
+            "height": [str(cell_value(v)) for v in trees["height"]],
+        },
+        geometry=gpd.points_from_xy(trees["lon"], trees["lat"]),
+        crs="EPSG:4326",
+    )
+
+    # Trees without a crown measurement still get a 1 m dot
+    radius = np.nan_to_num(trees["crown_radius"], nan=1.0)
+    rgb = np.array([COLOR_RGB[c] for c in tree_colors], dtype=np.uint8)
+
+    tree_layer = ScatterplotLayer.from_geopandas(
+        points,
+        get_radius=radius,
+        radius_units="meters",
+        radius_min_pixels=3,
+        get_fill_color=rgb.reshape(-1, 3),
+        opacity=0.6,
+    )
+
+    # -------------------------------------------------
+    # SCHOOL BOUNDARY
+    # -------------------------------------------------
+    boundary_layer = PolygonLayer.from_geopandas(
+        load_boundary(boundary_path),
+        filled=False,
+        get_line_color=[0, 0, 0],
+        get_line_width=1,
+        line_width_units="pixels",
+    )
+
+    # =================================================
+    # FINALIZE
+    # =================================================
+    m = Map(layers=[boundary_layer, tree_layer])
+
+    m.to_html(base_dir / OUTPUT_HTML)
+
+    print(f"✅ GPU map created for: {school_name}")
+    print(f"📄 Output: {OUTPUT_HTML}")
+
+    return m